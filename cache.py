@@ -0,0 +1,148 @@
+# cache.py
+# Py-n8n — persistent cache for AI summaries
+# ---------------------------------------------------------------
+# Responses are stored in a local SQLite file keyed by a SHA-256 of
+# everything that influences the model output (model, prompts,
+# normalized symptoms, urgency, temperature), so re-runs and repeated
+# inquiries don't pay for another OpenAI call.
+#
+# A second table keeps an embedding of each cached request's symptoms
+# (per embedding model, since vectors from different models don't compare),
+# so paraphrases ("chest pain since morning" / "chest pain this morning")
+# can reuse a cached answer via cosine similarity.
+# ---------------------------------------------------------------
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import unicodedata
+
+try:
+    import numpy as np  # optional: only the semantic lookup below needs it
+except ImportError:
+    np = None
+
+CACHE_DB = "ai_cache.db"
+SEMANTIC_THRESHOLD = 0.92  # min cosine similarity to reuse a cached answer
+
+_conn = None
+
+# In-memory copy of the embeddings table for one model, loaded on first use
+_emb_loaded_for = None  # (model, dim) of the rows below, None = not loaded
+_emb_keys: list[str] = []
+_emb_urgency = None  # (N,) object array
+_emb_matrix = None   # (N, dim) float32
+_emb_norms = None    # (N,) float32
+
+def _db() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        # Holds patient symptoms: create it owner-only (sqlite would use the umask)
+        os.close(os.open(CACHE_DB, os.O_RDWR | os.O_CREAT, 0o600))
+        os.chmod(CACHE_DB, 0o600)  # tighten a file left over from earlier versions
+        # Shared across runs; webhook.py serializes runs but may use different threads
+        _conn = sqlite3.connect(CACHE_DB, check_same_thread=False)
+        _conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache(key TEXT PRIMARY KEY, value TEXT, created REAL)"
+        )
+        # Rows from before the model column can't be told apart by model: drop them
+        cols = [r[1] for r in _conn.execute("PRAGMA table_info(embeddings)")]
+        if cols and "model" not in cols:
+            _conn.execute("DROP TABLE embeddings")
+        _conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings("
+            "model TEXT, key TEXT, urgency TEXT, vec BLOB, PRIMARY KEY (model, key))"
+        )
+    return _conn
+
+def nfc_norm(s: str) -> str:
+    """Unicode-normalizes, trims and lowercases text before hashing."""
+    return unicodedata.normalize("NFC", s or "").strip().lower()
+
+def make_key(parts: dict) -> str:
+    """Stable SHA-256 hex digest of a JSON-serializable dict."""
+    blob = json.dumps(parts, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+def cache_get(key: str, ttl: float | None = None) -> str | None:
+    """
+    Returns the cached value for `key`, or None on a miss.
+    With `ttl` (seconds), entries older than that count as misses.
+    """
+    row = _db().execute("SELECT value, created FROM cache WHERE key = ?", (key,)).fetchone()
+    if row is None:
+        return None
+    value, created = row
+    if ttl and time.time() - created > ttl:
+        return None
+    return value
+
+def cache_set(key: str, value: str) -> None:
+    conn = _db()
+    conn.execute(
+        "INSERT OR REPLACE INTO cache(key, value, created) VALUES (?, ?, ?)",
+        (key, value, time.time()),
+    )
+    conn.commit()
+
+# ---------- semantic (embedding) lookup ----------
+
+def _load_embeddings(model: str, dim: int) -> None:
+    """Loads the stored vectors of `model` (and of size `dim`) into memory."""
+    global _emb_loaded_for, _emb_keys, _emb_urgency, _emb_matrix, _emb_norms
+    rows = _db().execute(
+        "SELECT key, urgency, vec FROM embeddings WHERE model = ? AND length(vec) = ?",
+        (model, dim * np.dtype(np.float32).itemsize),
+    ).fetchall()
+    _emb_keys = [r[0] for r in rows]
+    _emb_urgency = np.array([r[1] for r in rows], dtype=object)
+    if rows:
+        _emb_matrix = np.vstack([np.frombuffer(r[2], dtype=np.float32) for r in rows])
+    else:
+        _emb_matrix = np.empty((0, dim), dtype=np.float32)
+    _emb_norms = np.linalg.norm(_emb_matrix, axis=1)
+    _emb_loaded_for = (model, dim)
+
+def semantic_get(vec: "np.ndarray", urgency: str, model: str, ttl: float | None = None) -> str | None:
+    """
+    Returns the cached value whose `model` embedding is most similar to `vec`
+    (same reported urgency, cosine >= SEMANTIC_THRESHOLD, not older than
+    `ttl`), or None.
+    """
+    if _emb_loaded_for != (model, vec.shape[0]):
+        _load_embeddings(model, vec.shape[0])
+    if not _emb_keys:
+        return None
+
+    sims = (_emb_matrix @ vec) / (_emb_norms * np.linalg.norm(vec) + 1e-12)
+    sims[_emb_urgency != urgency] = -1.0
+    # Best match first; an expired entry falls through to the next candidate
+    candidates = np.flatnonzero(sims >= SEMANTIC_THRESHOLD)
+    for i in candidates[np.argsort(-sims[candidates])]:
+        value = cache_get(_emb_keys[i], ttl=ttl)
+        if value is not None:
+            return value
+    return None
+
+def embedding_set(key: str, urgency: str, vec: "np.ndarray", model: str) -> None:
+    global _emb_loaded_for, _emb_urgency, _emb_matrix, _emb_norms
+    vec = np.asarray(vec, dtype=np.float32)
+    conn = _db()
+    conn.execute(
+        "INSERT OR REPLACE INTO embeddings(model, key, urgency, vec) VALUES (?, ?, ?, ?)",
+        (model, key, urgency, vec.tobytes()),
+    )
+    conn.commit()
+
+    # Keep the in-memory matrix in sync without re-reading the table
+    if _emb_loaded_for != (model, vec.shape[0]):
+        return  # not the loaded model; semantic_get reads it from the table
+    if key in _emb_keys:
+        _emb_loaded_for = None  # replaced row: reload on the next lookup
+        return
+    _emb_keys.append(key)
+    _emb_urgency = np.append(_emb_urgency, np.array([urgency], dtype=object))
+    _emb_matrix = np.vstack([_emb_matrix, vec])
+    _emb_norms = np.append(_emb_norms, np.linalg.norm(vec))
@@ -10,6 +10,7 @@
 #   PROCESSED_SHEET=Processed
 #   SLACK_BOT_TOKEN=xoxb-...              # optional
 #   SLACK_CHANNEL_ID=C0123456789          # optional
+#   AI_CACHE_TTL=604800                   # optional, seconds (blank = keep forever)
 #
 # Place Google service account key as: creds.json
 # Share your Google Sheet with creds.json's client_email (Editor).
@@ -18,11 +19,42 @@
 import os
 import sys
 import json
+import asyncio
+import socket
+import smtplib
+import threading
+from collections import namedtuple
+from operator import itemgetter
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from html import escape
+from urllib.error import URLError
+from string import Template
 import gspread
-import pandas as pd
+import requests
 import yagmail
 from dotenv import load_dotenv
+from google.auth.transport.requests import Request
 from google.oauth2.service_account import Credentials
+from gspread.utils import absolute_range_name, rowcol_to_a1
+from urllib3.exceptions import NewConnectionError
+
+from cache import cache_get, cache_set, embedding_set, make_key, nfc_norm, semantic_get
+
+try:
+    import orjson  # optional: faster JSON for the per-row summary payloads
+except ImportError:
+    orjson = None
+
+try:
+    import numpy as np  # optional: semantic (paraphrase) cache lookups
+except ImportError:
+    np = None
+
+try:
+    from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential_jitter
+except ImportError:  # optional: without it, calls simply aren't retried
+    retry = None
 
 # ---------- helpers ----------
 
@@ -30,15 +62,110 @@ def die(msg: str) -> None:
     print(f"❌ {msg}")
     sys.exit(1)
 
+def json_dumps(obj) -> str:
+    """Compact UTF-8 JSON text (orjson when installed, else stdlib)."""
+    if orjson:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+def json_loads(text: str):
+    return orjson.loads(text) if orjson else json.loads(text)
+
+# ---------- retries (Sheets / OpenAI / SMTP / Slack) ----------
+
+# Network-level failures worth another try; section 6 adds OpenAI's
+TRANSIENT_ERRORS = [
+    ConnectionError,
+    TimeoutError,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+]
+
+def _is_transient(e: BaseException) -> bool:
+    """Rate limits, 5xx and dropped connections; never 4xx request errors."""
+    # gspread APIError, openai APIStatusError and SlackApiError all carry .response
+    status = getattr(getattr(e, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    return isinstance(e, tuple(TRANSIENT_ERRORS))
+
+def _never_sent(e: BaseException) -> bool:
+    """Failures raised before the request could reach the server."""
+    if isinstance(e, (requests.exceptions.ConnectTimeout, smtplib.SMTPConnectError,
+                      ConnectionRefusedError, socket.gaierror)):
+        return True
+    if isinstance(e, requests.exceptions.ConnectionError):
+        # urllib3 couldn't open a socket (vs. a connection dropped mid-request)
+        return isinstance(getattr(e.args[0] if e.args else None, "reason", None), NewConnectionError)
+    if isinstance(e, URLError):  # slack_sdk talks to Slack through urllib
+        return isinstance(e.reason, (ConnectionRefusedError, socket.gaierror))
+    # SMTP only takes over a message once it answers the DATA with 250, so a
+    # disconnect (yagmail's False return, see send_email) means nothing was queued
+    return isinstance(e, smtplib.SMTPServerDisconnected)
+
+def _is_retry_safe(e: BaseException) -> bool:
+    """For writes that would duplicate if repeated: rate limits and unsent requests only."""
+    status = getattr(getattr(e, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status == 429
+    return _never_sent(e)
+
+def _retry_after(e: BaseException) -> float | None:
+    """Seconds from a numeric Retry-After header on the error's response, if any."""
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    for k, v in headers.items():
+        if k.lower() == "retry-after":
+            try:
+                return float(v)
+            except (TypeError, ValueError):
+                return None
+    return None
+
+if retry:
+    _backoff = wait_exponential_jitter(initial=1, max=30)
+
+    def _wait(retry_state) -> float:
+        # The server's Retry-After wins over our own schedule
+        delay = _retry_after(retry_state.outcome.exception())
+        return min(max(0, delay), 60) if delay is not None else _backoff(retry_state)
+
+    def _retrying(should_retry):
+        return retry(
+            stop=stop_after_attempt(5),
+            wait=_wait,
+            retry=retry_if_exception(should_retry),
+            reraise=True,  # callers see the original error after the last attempt
+        )
+
+    with_backoff = _retrying(_is_transient)
+    # Appends, Slack posts and emails aren't idempotent: a retry after a timeout
+    # or 5xx could deliver twice, so they only retry when nothing went out
+    with_cautious_backoff = _retrying(_is_retry_safe)
+else:
+    def with_backoff(fn):
+        return fn
+
+    with_cautious_backoff = with_backoff
+
+_header_cache: dict[int, list[str]] = {}  # worksheet id -> first-row headers
+
+def header_row(sheet) -> list[str]:
+    """
+    Returns the first row of `sheet`, fetched once per worksheet and run.
+    """
+    if sheet.id not in _header_cache:
+        _header_cache[sheet.id] = sheet.row_values(1)
+    return _header_cache[sheet.id]
+
 def ensure_column(sheet, header_name: str) -> int:
     """
     Ensures a header named `header_name` exists in the first row of `sheet`.
     Returns the 1-based column index of that header.
     """
-    headers = sheet.row_values(1)
+    headers = header_row(sheet)
     if header_name not in headers:
         sheet.update_cell(1, len(headers) + 1, header_name)
-        headers = sheet.row_values(1)
+        headers = _header_cache[sheet.id] = headers + [header_name]
     return headers.index(header_name) + 1  # 1-based
 
 # ---------- 1) load env ----------
@@ -55,6 +182,11 @@ PROCESSED_SHEET = os.getenv("PROCESSED_SHEET", "Processed").strip()
 SLACK_BOT_TOKEN = os.getenv("SLACK_BOT_TOKEN", "").strip() # optional
 SLACK_CHANNEL_ID= os.getenv("SLACK_CHANNEL_ID", "").strip() # optional
 
+try:
+    AI_CACHE_TTL = float(os.getenv("AI_CACHE_TTL", "").strip() or 0) or None  # optional
+except ValueError:
+    die("AI_CACHE_TTL must be a number of seconds (leave blank to keep entries forever).")
+
 if not (SPREADSHEET_ID or SPREADSHEET_NAME):
     die("Provide SPREADSHEET_ID (preferred) or SPREADSHEET_NAME in .env.")
 
@@ -69,41 +201,98 @@ SCOPES = [
     "https://www.googleapis.com/auth/drive.readonly",
 ]
 
-creds = Credentials.from_service_account_file("creds.json", scopes=SCOPES)
-client = gspread.authorize(creds)
+# Access tokens live ~1h; cache them so frequent cron runs skip the OAuth exchange
+TOKEN_CACHE = ".gspread-token.json"
 
-try:
-    if SPREADSHEET_ID:
-        wb = client.open_by_key(SPREADSHEET_ID)  # robust: avoid Drive search
-    else:
-        wb = client.open(SPREADSHEET_NAME)       # requires Drive RO
-except Exception as e:
-    die(f"Cannot open spreadsheet (ID={SPREADSHEET_ID or 'None'}, NAME='{SPREADSHEET_NAME or 'None'}'): {e}")
+def load_cached_token(creds) -> bool:
+    """
+    Puts a cached access token on `creds` if it was issued for the same
+    account + scopes and google-auth still considers it valid (i.e. it won't
+    be refreshed before the first request anyway).
+    """
+    try:
+        with open(TOKEN_CACHE, encoding="utf-8") as f:
+            cached = json.load(f)
+        if cached["client_email"] != creds.service_account_email or cached["scopes"] != SCOPES:
+            return False
+        expiry = datetime.fromisoformat(cached["expiry"])
+    except Exception:
+        return False
+    creds.token = cached["token"]
+    creds.expiry = expiry  # naive UTC, as google-auth stores it
+    # .valid applies google-auth's own refresh threshold (a few minutes)
+    return creds.valid
+
+def save_token(creds) -> None:
+    data = {
+        "client_email": creds.service_account_email,
+        "scopes": SCOPES,
+        "token": creds.token,
+        "expiry": creds.expiry.isoformat(),
+    }
+    try:
+        # Owner-only: the file holds a live bearer token
+        fd = os.open(TOKEN_CACHE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+    except Exception as e:
+        print(f"⚠️ Could not cache Google token: {e}")
 
-# First sheet = Google Form responses
-sheet = wb.sheet1
+def google_credentials() -> Credentials:
+    creds = Credentials.from_service_account_file("creds.json", scopes=SCOPES)
+    if not load_cached_token(creds):
+        try:
+            creds.refresh(Request())
+        except Exception as e:
+            die(f"Google auth failed (check creds.json): {e}")
+        save_token(creds)
+    return creds
 
-# Ensure Processed sheet exists
-try:
-    processed_ws = wb.worksheet(PROCESSED_SHEET)
-except gspread.exceptions.WorksheetNotFound:
-    processed_ws = wb.add_worksheet(title=PROCESSED_SHEET, rows=200, cols=10)
-    processed_ws.update("A1:F1", [["Timestamp", "Name", "Email", "Summary", "Urgency", "Status"]])
+def open_workbook(client):
+    try:
+        if SPREADSHEET_ID:
+            return client.open_by_key(SPREADSHEET_ID)  # robust: avoid Drive search
+        return client.open(SPREADSHEET_NAME)           # requires Drive RO
+    except Exception as e:
+        die(f"Cannot open spreadsheet (ID={SPREADSHEET_ID or 'None'}, NAME='{SPREADSHEET_NAME or 'None'}'): {e}")
+
+def open_worksheets(wb):
+    """
+    Returns (responses sheet, Processed sheet), creating the latter if needed.
+    """
+    # One metadata fetch for both tabs (wb.sheet1 and wb.worksheet() each do their own)
+    worksheets = wb.worksheets()
+
+    # First sheet = Google Form responses
+    sheet = worksheets[0]
+
+    # Ensure Processed sheet exists
+    processed_ws = next((ws for ws in worksheets if ws.title == PROCESSED_SHEET), None)
+    if processed_ws is None:
+        processed_ws = wb.add_worksheet(title=PROCESSED_SHEET, rows=200, cols=10)
+        processed_ws.update("A1:F1", [["Timestamp", "Name", "Email", "Summary", "Urgency", "Status"]])
+    return sheet, processed_ws
 
 # ---------- 3) load responses & normalize headers ----------
 
-records = sheet.get_all_records()  # row 1 as headers
-df = pd.DataFrame(records)
+def sheet_range(sheet, a1: str) -> str:
+    return absolute_range_name(sheet.title, a1)
 
-if df.empty:
-    print("ℹ️ Sheet is empty. Submit one test response in the Form, then re-run.")
-    sys.exit(0)
+def row_runs(rows: list[int]) -> list[tuple[int, int]]:
+    """
+    Collapses ascending row numbers into (first, last) runs,
+    e.g. [5, 6, 7, 10] -> [(5, 7), (10, 10)].
+    """
+    runs = []
+    for r in rows:
+        if runs and r == runs[-1][1] + 1:
+            runs[-1] = (runs[-1][0], r)
+        else:
+            runs.append((r, r))
+    return runs
 
-# Ensure a 'Processed' column exists (both sheet & df)
-if "Processed" not in df.columns:
-    ensure_column(sheet, "Processed")
-    records = sheet.get_all_records()
-    df = pd.DataFrame(records)
+SHEET_EMPTY_MSG = "ℹ️ Sheet is empty. Submit one test response in the Form, then re-run."
+MAX_ROW_RANGES = 20  # past this many ranges, one full read is simpler
 
 # Case-insensitive aliases → canonical names
 aliases = {
@@ -118,40 +307,124 @@ aliases = {
     "Urgency":   ["urgency", "priority", "severity", "how urgent"],
 }
 
-lower_map = {c.lower().strip(): c for c in df.columns}
-renames = {}
-for canonical, variants in aliases.items():
-    if canonical in df.columns:
-        continue
-    found_src = None
-    for v in variants:
-        src = lower_map.get(v.lower().strip())
-        if src:
-            found_src = src
-            break
-    if found_src:
-        renames[found_src] = canonical
-
-if renames:
-    df = df.rename(columns=renames)
+# Flat lookup: normalized header → (canonical name, priority within its alias list);
+# canonical names map to themselves with top priority
+ALIAS2CANON = {v.lower().strip(): (k, rank) for k, vs in aliases.items() for rank, v in enumerate(vs)}
+for k in aliases:
+    ALIAS2CANON.setdefault(k.lower(), (k, 0))
 
 required_cols = ["Timestamp", "Name", "Email", "Symptoms", "Urgency"]
-missing = [c for c in required_cols if c not in df.columns]
-if missing:
-    print("Columns present:", list(df.columns))
-    die(f"Missing required columns after normalization: {missing}. "
-        f"Rename your sheet headers or adjust Form question titles.")
-
-# Unprocessed rows
-new_rows_df = df[df.get("Processed", "") != "Yes"]
-if new_rows_df.empty:
-    print("✅ No new inquiries.")
-    sys.exit(0)
+Inquiry = namedtuple("Inquiry", required_cols)
+
+def load_new_rows(wb, sheet) -> tuple[list, int]:
+    """
+    Returns ([(sheet row, Inquiry), ...] for unprocessed responses,
+    1-based index of the Processed column). The list is empty (and the
+    reason printed) when there's nothing to do.
+    """
+    headers = header_row(sheet)
+    if not headers:
+        print(SHEET_EMPTY_MSG)
+        return [], 0
+
+    # Cheap pre-check for the common cron case (nothing new): fetch only column A
+    # and the Processed column in one batchGet before paying for the full sheet.
+    # Column A (the Form timestamp) is filled on every response, so it gives the
+    # row count that trailing blank Processed cells would otherwise hide.
+    runs = [(2, None)]  # sheet row ranges to read; default: every data row
+    if "Processed" in headers:
+        col = rowcol_to_a1(1, headers.index("Processed") + 1)[:-1]  # "F1" -> "F"
+        raw = wb.values_batch_get([sheet_range(sheet, "A2:A"), sheet_range(sheet, f"{col}2:{col}")])
+        first_col, processed_col = (vr.get("values", []) for vr in raw["valueRanges"])
+        n_rows = max(len(first_col), len(processed_col))
+        if not n_rows:
+            print(SHEET_EMPTY_MSG)
+            return [], 0
+        pending = [
+            i + 2 for i in range(n_rows)
+            if i >= len(processed_col) or processed_col[i][:1] != ["Yes"]
+        ]
+        if not pending:
+            print("✅ No new inquiries.")
+            return [], 0
+        # Filter before loading: read only the unprocessed rows
+        pending_runs = row_runs(pending)
+        if len(pending_runs) <= MAX_ROW_RANGES:
+            runs = pending_runs
+
+    # Read the selected data rows (row 1 is the header row fetched above) and
+    # keep each row's sheet row number for the Processed write-back.
+    raw = wb.values_batch_get([sheet_range(sheet, f"A{first}:ZZ{last or ''}") for first, last in runs])
+    data_rows = [
+        (first + i, r)
+        for (first, _), vr in zip(runs, raw["valueRanges"])
+        for i, r in enumerate(vr.get("values", []))
+    ]
+
+    if not data_rows:
+        print(SHEET_EMPTY_MSG)
+        return [], 0
+
+    # Ensure a 'Processed' column exists; if it's added, the new column is blank
+    # server-side, so the rows read above don't need re-reading.
+    processed_col_idx = ensure_column(sheet, "Processed")
+    headers = header_row(sheet)
+
+    # One pass over the headers; when several match the same canonical name the
+    # one earliest in its alias list wins, and a canonical name that's already
+    # a real column is never duplicated by a rename.
+    best = {}  # canonical → (rank, header)
+    for c in headers:
+        hit = ALIAS2CANON.get(c.lower().strip())
+        if not hit or hit[0] in headers:
+            continue
+        canonical, rank = hit
+        if canonical not in best or rank < best[canonical][0]:
+            best[canonical] = (rank, c)
+    renames = {c: canonical for canonical, (_, c) in best.items()}
+
+    columns = [renames.get(c, c) for c in headers]
+
+    missing = [c for c in required_cols if c not in columns]
+    if missing:
+        print("Columns present:", columns)
+        die(f"Missing required columns after normalization: {missing}. "
+            f"Rename your sheet headers or adjust Form question titles.")
+
+    # Unprocessed rows, filtered straight off the raw values (no DataFrame).
+    # The API drops trailing empty cells, so short rows have a blank Processed
+    # cell and are padded to the header width. Each kept row becomes a light
+    # namedtuple of just the required fields instead of a full per-row dict.
+    pick = itemgetter(*(columns.index(c) for c in required_cols))
+
+    processed_idx = processed_col_idx - 1
+    width = len(columns)
+    rows_iter = (
+        (sheet_row, Inquiry._make(pick(r + [""] * (width - len(r)))))
+        for sheet_row, r in data_rows
+        if len(r) <= processed_idx or r[processed_idx] != "Yes"
+    )
+    new_rows = list(rows_iter)
+    if not new_rows:
+        print("✅ No new inquiries.")
+    return new_rows, processed_col_idx
 
 # ---------- 4) email (SMTP) setup with SSL 465 fallback to 587 ----------
 
 EMAIL_HOST = "smtp.gmail.com"
 
+# HTML body; every substituted value is HTML-escaped by the caller
+EMAIL_TPL = Template("""
+    <h3>New Patient Inquiry</h3>
+    <b>Name:</b> $name<br>
+    <b>Email:</b> $email<br>
+    <b>Reported Urgency:</b> $urgency<br><br>
+    <b>AI Summary (JSON):</b><br><pre style="white-space:pre-wrap;">$ai_json</pre>
+    <hr>
+    <small>Timestamp: $timestamp</small><br>
+    <small>Raw Symptoms: $symptoms</small>
+    """)
+
 def connect_yagmail():
     # Prefer SSL (port 465) for stricter networks
     try:
@@ -176,13 +449,43 @@ def connect_yagmail():
             timeout=30,
         )
 
-yag = None
-if EMAIL_USER and EMAIL_PASS:
+# Sends run on a small thread pool so SMTP overlaps the rest of the loop.
+# smtplib isn't thread-safe, so each worker has its own yagmail object. That
+# object only remembers the settings that worked (465 or 587): yagmail's send()
+# opens and logs in a fresh connection on every call, so there's nothing to reuse.
+EMAIL_WORKERS = 4
+
+_smtp_local = threading.local()
+
+def login_email() -> bool:
+    """
+    Logs in once up front so a bad password is reported before processing.
+    Returns False (emails skipped) when SMTP isn't configured or reachable.
+    """
+    if not (EMAIL_USER and EMAIL_PASS):
+        return False
     try:
-        yag = connect_yagmail()
+        connect_yagmail().close()
     except Exception as e:
         print(f"⚠️ Email login failed on both 465 and 587: {e}\n"
               f"   → Will continue without sending emails.")
+        return False
+    return True
+
+@with_cautious_backoff
+def send_email(subject: str, body: str) -> None:
+    conn = getattr(_smtp_local, "yag", None)
+    if conn is None:
+        conn = _smtp_local.yag = connect_yagmail()
+        conn.close()  # send() logs in again anyway
+    try:
+        sent = conn.send(to=EMAIL_USER, subject=subject, contents=body)
+    finally:
+        conn.close()  # quit the connection this send() opened
+    # yagmail swallows SMTPServerDisconnected and signals the failure only by
+    # returning False; raise so the send is retried and reported
+    if sent is False:
+        raise smtplib.SMTPServerDisconnected("yagmail could not send the message")
 
 # ---------- 5) optional: Slack notify ----------
 
@@ -198,134 +501,338 @@ def slack_notify(text: str) -> bool:
     if not slack:
         return False
     try:
-        slack.chat_postMessage(channel=SLACK_CHANNEL_ID, text=text)
+        with_cautious_backoff(slack.chat_postMessage)(channel=SLACK_CHANNEL_ID, text=text)
         return True
     except Exception as e:
         print(f"⚠️ Slack send failed: {e}")
         return False
 
+# chat.postMessage is rate-limited to ~1 msg/s, so rows are sent as a digest
+SLACK_MAX_CHARS = 3500  # per message; Slack truncates very long text
+
+def slack_digest(entries: list[str]) -> None:
+    """Posts `entries` in as few messages as fit under SLACK_MAX_CHARS."""
+    if not slack or not entries:
+        return
+    msg = f"*New patient inquiries: {len(entries)}*"
+    for entry in entries:
+        if len(msg) + len(entry) + 2 > SLACK_MAX_CHARS:
+            slack_notify(msg)
+            msg = entry
+        else:
+            msg = f"{msg}\n\n{entry}"
+    slack_notify(msg)
+
 # ---------- 6) optional: OpenAI client ----------
 
+OPENAI_CONCURRENCY = 8  # max in-flight chat requests (keeps us under rate limits)
+OPENAI_BATCH_SIZE = 10  # inquiries summarized per chat request
+OPENAI_MODEL = "gpt-4o-mini"
+OPENAI_TEMPERATURE = 0    # deterministic output (also keeps cached answers stable)
+OPENAI_SEED = 42
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# Everything fixed lives in the system message so each request starts with an
+# identical prefix (OpenAI caches repeated prefixes); the user message carries
+# only the per-batch items.
+SYSTEM_PROMPT = """\
+You triage patient inquiries submitted through a web form.
+Return ONLY valid compact JSON.
+
+Input: a JSON object {"items": [{"id": 0, "symptoms": "...", "reported_urgency": "..."}, ...]}.
+
+For each entry in `items`:
+- summarize the patient's symptoms in 2 concise lines,
+- classify urgency as one of [Low, Medium, High],
+- provide 3 keywords.
+
+Output: a JSON object {"results": [...]} with exactly one element per item,
+in the same order, each shaped like:
+{"id": <the item's id>, "summary": "...", "urgency": "Low|Medium|High", "keywords": ["...", "...", "..."]}
+
+Rules:
+- Never skip, merge or reorder items; always copy each item's `id` unchanged.
+- Base the summary only on the given symptoms; do not invent details.
+- If the symptoms are empty or unclear, say so in the summary and keep the reported urgency.
+"""
+
+def make_http_client():
+    """
+    Shared keep-alive pool for every OpenAI call in the run; HTTP/2 (when
+    the 'h2' package is installed) lets concurrent batches share one connection.
+    """
+    import httpx
+    limits = httpx.Limits(max_keepalive_connections=10, keepalive_expiry=60)
+    timeout = httpx.Timeout(30.0)
+    try:
+        return httpx.AsyncClient(http2=True, limits=limits, timeout=timeout)
+    except ImportError:  # h2 missing → plain HTTP/1.1 keep-alive
+        return httpx.AsyncClient(limits=limits, timeout=timeout)
+
 use_openai = bool(OPENAI_API_KEY)
 if use_openai:
     try:
-        import openai
-        openai.api_key = OPENAI_API_KEY
+        from openai import APIConnectionError, AsyncOpenAI
+        TRANSIENT_ERRORS.append(APIConnectionError)  # includes timeouts
     except Exception as e:
         print(f"⚠️ OpenAI import/init failed, proceeding without AI: {e}")
         use_openai = False
 
-def ai_summarize(symptoms: str, urgency: str) -> str:
+@with_backoff
+async def _openai_call(method, **kwargs):
+    # Explicit coroutine so tenacity retries the awaited request itself
+    return await method(**kwargs)
+
+def _summary_json(summary: str, urgency: str, keywords: list | None = None) -> str:
+    return json_dumps({
+        "summary": summary,
+        "urgency": urgency or "Unknown",
+        "keywords": keywords or []
+    })
+
+def _cache_key(symptoms: str, urgency: str) -> str:
+    return make_key({
+        "model": OPENAI_MODEL,
+        "sys": SYSTEM_PROMPT,
+        "symptoms": nfc_norm(symptoms),
+        "urgency": urgency,
+        "temp": OPENAI_TEMPERATURE,
+        "seed": OPENAI_SEED,
+    })
+
+async def ai_summarize_batch(aclient, items: list[dict]) -> list[str]:
     """
-    Returns JSON string: {"summary": "...", "urgency": "...", "keywords": [...]}
-    Falls back to simple JSON if OpenAI isn't configured.
+    Summarizes up to OPENAI_BATCH_SIZE inquiries in one JSON-mode request.
+    `items` are {"symptoms", "urgency", "key"[, "vec"]} dicts; returns one
+    JSON string per item, in order: {"summary", "urgency", "keywords"}.
+    Answers are matched back by id; unless every item comes back exactly
+    once, the whole batch counts as failed and nothing is cached.
     """
-    if not use_openai:
-        trunc = (symptoms or "")[:200].replace("\n", " ")
-        return json.dumps({
-            "summary": f"Reported symptoms: {trunc}...",
-            "urgency": urgency or "Unknown",
-            "keywords": []
-        }, ensure_ascii=False)
-
+    payload = {"items": [
+        {"id": i, "symptoms": it["symptoms"], "reported_urgency": it["urgency"]}
+        for i, it in enumerate(items)
+    ]}
     try:
-        resp = openai.chat.completions.create(
-            model="gpt-4o-mini",
+        resp = await _openai_call(
+            aclient.chat.completions.create,
+            model=OPENAI_MODEL,
             messages=[
-                {"role": "system", "content": "Return ONLY valid compact JSON."},
-                {"role": "user", "content": (
-                    "Summarize the patient's symptoms in 2 concise lines, "
-                    "classify urgency as one of [Low, Medium, High], and provide 3 keywords. "
-                    "Return JSON with keys: summary, urgency, keywords.\n\n"
-                    f"Symptoms: {symptoms}\nReported urgency: {urgency}"
-                )},
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": json_dumps(payload)},
             ],
-            temperature=0.2,
+            temperature=OPENAI_TEMPERATURE,
+            seed=OPENAI_SEED,
+            response_format={"type": "json_object"},
         )
-        content = resp.choices[0].message.content.strip()
-        # Try to parse JSON; if not JSON, wrap as summary text
-        try:
-            parsed = json.loads(content)
-            out = {
-                "summary": parsed.get("summary", "").strip(),
-                "urgency": (parsed.get("urgency") or urgency or "Unknown").strip(),
-                "keywords": parsed.get("keywords", []),
-            }
-            return json.dumps(out, ensure_ascii=False)
-        except Exception:
-            return json.dumps({
-                "summary": content[:600],
-                "urgency": urgency or "Unknown",
-                "keywords": []
-            }, ensure_ascii=False)
+        results = json_loads(resp.choices[0].message.content)["results"]
+        if not isinstance(results, list):
+            raise ValueError("'results' is not a list")
+        by_id = {res.get("id"): res for res in results if isinstance(res, dict)}
+        if len(results) != len(items) or set(by_id) != set(range(len(items))):
+            raise ValueError(f"results don't match the inquiries sent ({len(results)} for {len(items)})")
     except Exception as e:
-        return json.dumps({
-            "summary": f"(OpenAI error: {e})",
-            "urgency": urgency or "Unknown",
-            "keywords": []
-        }, ensure_ascii=False)
+        return [_summary_json(f"(OpenAI error: {e})", it["urgency"]) for it in items]
+
+    out = []
+    for i, it in enumerate(items):
+        res = by_id[i]
+        summary = _summary_json(
+            str(res.get("summary") or "").strip(),
+            str(res.get("urgency") or it["urgency"] or "Unknown").strip(),
+            res.get("keywords") or [],
+        )
+        try:
+            cache_set(it["key"], summary)
+            if it.get("vec") is not None:
+                embedding_set(it["key"], it["urgency"], it["vec"], EMBEDDING_MODEL)
+        except Exception as e:
+            print(f"⚠️ Could not cache summary, using it uncached: {e}")
+        out.append(summary)
+    return out
 
-# ---------- 7) process each unprocessed row ----------
+async def ai_summarize_all(aclient, items: list[dict]) -> list[str]:
+    """
+    Returns one JSON summary string per {"symptoms", "urgency"} item.
+    Lookup order: exact cache, semantic cache, then batched chat requests
+    (run concurrently) for whatever is left.
+    Falls back to simple JSON if OpenAI isn't configured (`aclient` is None).
+    """
+    if aclient is None:
+        out = []
+        for it in items:
+            trunc = (it["symptoms"] or "")[:200].replace("\n", " ")
+            out.append(_summary_json(f"Reported symptoms: {trunc}...", it["urgency"]))
+        return out
+
+    # Same request → same answer: check the local cache before calling OpenAI
+    results = [None] * len(items)
+    for i, it in enumerate(items):
+        it["key"] = _cache_key(it["symptoms"], it["urgency"])
+        results[i] = cache_get(it["key"], ttl=AI_CACHE_TTL)
+
+    # Near-duplicate wording → reuse a semantically similar cached answer
+    # (one embeddings request covers every miss; needs numpy)
+    to_embed = [i for i, r in enumerate(results) if r is None and items[i]["symptoms"]]
+    if to_embed and np is not None:
+        try:
+            emb = await _openai_call(
+                aclient.embeddings.create,
+                model=EMBEDDING_MODEL, input=[items[i]["symptoms"] for i in to_embed],
+            )
+            for d in emb.data:
+                i = to_embed[d.index]
+                items[i]["vec"] = np.asarray(d.embedding, dtype=np.float32)
+                results[i] = semantic_get(
+                    items[i]["vec"], items[i]["urgency"], EMBEDDING_MODEL, ttl=AI_CACHE_TTL
+                )
+        except Exception as e:
+            print(f"⚠️ Embedding lookup failed, skipping semantic cache: {e}")
+
+    misses = [i for i, r in enumerate(results) if r is None]
+    batches = [misses[j:j + OPENAI_BATCH_SIZE] for j in range(0, len(misses), OPENAI_BATCH_SIZE)]
+    outputs = await _bounded_gather(
+        [ai_summarize_batch(aclient, [items[i] for i in b]) for b in batches],
+        limit=OPENAI_CONCURRENCY,
+    )
+    for b, outs in zip(batches, outputs):
+        for i, out in zip(b, outs):
+            results[i] = out
+    return results
+
+async def _bounded_gather(coros, limit: int) -> list:
+    """
+    Like asyncio.gather, but runs at most `limit` coroutines at a time.
+    Results keep the order of `coros`.
+    """
+    sem = asyncio.Semaphore(limit)
 
-processed_col_idx = ensure_column(sheet, "Processed")
-updates_made = 0
+    async def run(coro):
+        async with sem:
+            return await coro
 
-for idx, row in new_rows_df.iterrows():
-    name      = str(row.get("Name", "")).strip()
-    email     = str(row.get("Email", "")).strip()
-    symptoms  = str(row.get("Symptoms", "")).strip()
-    urgency   = str(row.get("Urgency", "")).strip()
-    timestamp = str(row.get("Timestamp", "")).strip()
+    return await asyncio.gather(*(run(c) for c in coros))
 
-    # AI JSON summary
-    ai_json = ai_summarize(symptoms, urgency)
+async def summarize_rows(items: list[dict]) -> list[str]:
+    """
+    Runs ai_summarize_all with an OpenAI client that lives for this event
+    loop only (its connection pool can't outlive the loop).
+    """
+    if not use_openai:
+        return await ai_summarize_all(None, items)
+    # max_retries=0: with_backoff owns retries, so they aren't stacked on the SDK's
+    async with AsyncOpenAI(
+        api_key=OPENAI_API_KEY, http_client=make_http_client(), max_retries=0
+    ) as aclient:
+        return await ai_summarize_all(aclient, items)
 
-    # Email content (HTML)
-    subject = f"New Patient Inquiry — {urgency or 'Unknown'} — {name or 'Unknown'}"
-    body = f"""
-    <h3>New Patient Inquiry</h3>
-    <b>Name:</b> {name or '-'}<br>
-    <b>Email:</b> {email or '-'}<br>
-    <b>Reported Urgency:</b> {urgency or '-'}<br><br>
-    <b>AI Summary (JSON):</b><br><pre style="white-space:pre-wrap;">{ai_json}</pre>
-    <hr>
-    <small>Timestamp: {timestamp or '-'}</small><br>
-    <small>Raw Symptoms: {(symptoms or '-').replace('<','&lt;').replace('>','&gt;')}</small>
+# ---------- 7) process each unprocessed row ----------
+
+def run_once() -> None:
     """
+    One full pass: read new responses, summarize, notify, mark processed.
+    """
+    _header_cache.clear()  # headers may change between runs
+
+    client = gspread.authorize(google_credentials())
+    wb = open_workbook(client)
+    sheet, processed_ws = open_worksheets(wb)
+
+    new_rows, processed_col_idx = load_new_rows(wb, sheet)
+    if not new_rows:
+        return
+
+    email_ok = login_email()
+
+    updates_made = 0
+
+    # AI JSON summaries for all rows (cached, batched and requested concurrently)
+    ai_results = asyncio.run(summarize_rows([
+        {"symptoms": r.Symptoms.strip(), "urgency": r.Urgency.strip()}
+        for _, r in new_rows
+    ]))
+
+    # Sheet writes are collected here and flushed in one request each after the
+    # loop, keyed by sheet row number so failed rows can be reported/retried.
+    processed_updates = {}  # sheet row -> {"range": ..., "values": [["Yes"]]}
+    processed_rows = {}     # sheet row -> row for the Processed tab
+
+    email_pool = ThreadPoolExecutor(max_workers=EMAIL_WORKERS)
+    email_futures = {}      # future -> recipient label for logging
+    slack_entries = []
+
+    for (sheet_row, row), ai_json in zip(new_rows, ai_results):
+        name      = row.Name.strip()
+        email     = row.Email.strip()
+        symptoms  = row.Symptoms.strip()
+        urgency   = row.Urgency.strip()
+        timestamp = row.Timestamp.strip()
+
+        # Email content (HTML)
+        subject = f"New Patient Inquiry — {urgency or 'Unknown'} — {name or 'Unknown'}"
+        body = EMAIL_TPL.substitute(
+            name=escape(name or "-"),
+            email=escape(email or "-"),
+            urgency=escape(urgency or "-"),
+            ai_json=escape(ai_json),
+            timestamp=escape(timestamp or "-"),
+            symptoms=escape(symptoms or "-"),
+        )
+
+        # Send email if possible
+        if email_ok:
+            email_futures[email_pool.submit(send_email, subject, body)] = name or "(no name)"
+        else:
+            print(f"ℹ️ Skipping email for {name or '(no name)'} (SMTP unavailable)")
 
-    # Send email if possible
-    if yag:
+        # Slack notification (optional), posted as one digest after the loop
+        slack_entries.append(f"*{subject}*\n{timestamp}\n{name} <{email}>\n```{ai_json}```")
+
+        # Mark processed in responses sheet
+        processed_updates[sheet_row] = {
+            "range": rowcol_to_a1(sheet_row, processed_col_idx),
+            "values": [["Yes"]],
+        }
+
+        # Append to Processed sheet
         try:
-            yag.send(to=EMAIL_USER, subject=subject, contents=body)
-            print(f"📧 Sent summary for {name or '(no name)'}")
-        except Exception as e:
-            print(f"⚠️ Email send failed for {name or '(no name)'}: {e}")
-    else:
-        print(f"ℹ️ Skipping email for {name or '(no name)'} (SMTP unavailable)")
+            parsed = json_loads(ai_json)
+            summary_text = parsed.get("summary", "")
+            urgency_final = parsed.get("urgency", urgency or "Unknown")
+        except Exception:
+            summary_text = ai_json
+            urgency_final = urgency or "Unknown"
 
-    # Slack notification (optional)
-    slack_notify(f"*{subject}*\n{timestamp}\n{name} <{email}>\n```{ai_json}```")
+        processed_rows[sheet_row] = [timestamp, name, email, summary_text, urgency_final, "Processed"]
 
-    # Mark processed in responses sheet (+2 for header and df zero-index)
-    try:
-        sheet.update_cell(idx + 2, processed_col_idx, "Yes")
-    except Exception as e:
-        print(f"⚠️ Could not mark row {idx + 2} as processed: {e}")
+        updates_made += 1
 
-    # Append to Processed sheet
-    try:
-        parsed = json.loads(ai_json)
-        summary_text = parsed.get("summary", "")
-        urgency_final = parsed.get("urgency", urgency or "Unknown")
-    except Exception:
-        summary_text = ai_json
-        urgency_final = urgency or "Unknown"
+    # Flush sheet writes (one request per sheet) while the emails are still
+    # going out, so a slow or failing SMTP server can't hold the rows unmarked
+    if processed_updates:
+        try:
+            with_backoff(sheet.batch_update)(list(processed_updates.values()), value_input_option="RAW")
+        except Exception as e:
+            print(f"⚠️ Could not mark rows {sorted(processed_updates)} as processed: {e}")
 
-    try:
-        processed_ws.append_row([timestamp, name, email, summary_text, urgency_final, "Processed"])
-    except Exception as e:
-        print(f"⚠️ Could not append to '{PROCESSED_SHEET}': {e}")
+    if processed_rows:
+        try:
+            with_cautious_backoff(processed_ws.append_rows)(list(processed_rows.values()), value_input_option="RAW")
+        except Exception as e:
+            print(f"⚠️ Could not append rows {sorted(processed_rows)} to '{PROCESSED_SHEET}': {e}")
+
+    slack_digest(slack_entries)
+
+    # Wait for the queued emails
+    for fut in as_completed(email_futures):
+        label = email_futures[fut]
+        try:
+            fut.result()
+            print(f"📧 Sent summary for {label}")
+        except Exception as e:
+            print(f"⚠️ Email send failed for {label}: {e}")
+    email_pool.shutdown()
 
-    updates_made += 1
+    print(f"✅ All new entries processed. Rows updated: {updates_made}")
 
-print(f"✅ All new entries processed. Rows updated: {updates_made}")
+if __name__ == "__main__":
+    run_once()
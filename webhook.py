@@ -0,0 +1,147 @@
+# webhook.py
+# Py-n8n — push-driven runner (replaces cron polling)
+# ---------------------------------------------------------------
+# Google Drive POSTs a change notification to /sheets-webhook whenever
+# the spreadsheet is edited; each one triggers run_once() from
+# patient_automation.py. The watch channel is registered on startup
+# and renewed before it expires.
+#
+# ENV (in addition to patient_automation.py's; SPREADSHEET_ID required):
+#   WEBHOOK_URL=https://your-host/sheets-webhook   # public HTTPS address
+#   WEBHOOK_TOKEN=some-random-string               # checked on every push
+#
+# Run:  uvicorn webhook:app --host 0.0.0.0 --port 8000
+# ---------------------------------------------------------------
+
+import os
+import time
+import uuid
+import threading
+from contextlib import asynccontextmanager
+
+from fastapi import BackgroundTasks, FastAPI, Request, Response
+from google.auth.transport.requests import AuthorizedSession
+
+from patient_automation import SPREADSHEET_ID, die, google_credentials, run_once
+
+WEBHOOK_URL   = os.getenv("WEBHOOK_URL", "").strip()
+WEBHOOK_TOKEN = os.getenv("WEBHOOK_TOKEN", "").strip()
+
+if not SPREADSHEET_ID:
+    die("Webhook mode needs SPREADSHEET_ID (the Drive file to watch) in .env.")
+
+if not WEBHOOK_URL:
+    die("Provide WEBHOOK_URL (public HTTPS address of /sheets-webhook) in .env.")
+
+# The endpoint is public: without a shared secret anyone could trigger runs
+if not WEBHOOK_TOKEN:
+    die("Provide WEBHOOK_TOKEN (a random string Drive echoes on every push) in .env.")
+
+DRIVE_API    = "https://www.googleapis.com/drive/v3"
+CHANNEL_TTL  = 24 * 3600  # seconds; Drive caps file watch channels at one day
+RENEW_MARGIN = 10 * 60    # re-register this long before the channel expires
+
+# ---------- 1) Drive watch channel ----------
+
+def start_channel(session) -> dict:
+    body = {
+        "id": str(uuid.uuid4()),
+        "type": "web_hook",
+        "address": WEBHOOK_URL,
+        "expiration": int((time.time() + CHANNEL_TTL) * 1000),  # ms
+        "token": WEBHOOK_TOKEN,
+    }
+    resp = session.post(f"{DRIVE_API}/files/{SPREADSHEET_ID}/watch", json=body)
+    resp.raise_for_status()
+    return resp.json()
+
+def stop_channel(session, channel: dict) -> None:
+    try:
+        resp = session.post(
+            f"{DRIVE_API}/channels/stop",
+            json={"id": channel["id"], "resourceId": channel["resourceId"]},
+        )
+        resp.raise_for_status()
+    except Exception as e:
+        print(f"⚠️ Could not stop watch channel {channel['id']}: {e}")
+
+_stop = threading.Event()
+
+def keep_watching() -> None:
+    """
+    Registers the watch channel, then replaces it shortly before it expires
+    (the new one is opened first so no change goes unnoticed).
+    """
+    session = None
+    channel = None
+    while not _stop.is_set():
+        try:
+            if session is None:
+                session = AuthorizedSession(google_credentials())
+            new_channel = start_channel(session)
+        except (SystemExit, Exception) as e:  # die() raises SystemExit on auth errors
+            print(f"⚠️ Could not register Drive watch: {e} — retrying in 60s")
+            _stop.wait(60)
+            continue
+        if channel:
+            stop_channel(session, channel)
+        channel = new_channel
+        print(f"👀 Watching spreadsheet (channel {channel['id']})")
+
+        expires = int(channel.get("expiration", 0)) / 1000 or time.time() + CHANNEL_TTL
+        _stop.wait(max(60, expires - time.time() - RENEW_MARGIN))
+    if channel:
+        stop_channel(session, channel)
+
+# ---------- 2) runs ----------
+
+_run_lock = threading.Lock()
+_pending = threading.Event()
+
+def trigger_run() -> None:
+    """
+    Runs run_once(), never two at a time. Notifications that arrive during
+    a run are coalesced into a single follow-up run.
+    """
+    _pending.set()
+    while _pending.is_set():
+        if not _run_lock.acquire(blocking=False):
+            return  # the active run will loop once more and pick the change up
+        try:
+            _pending.clear()
+            try:
+                run_once()
+            except SystemExit:
+                pass  # die() already printed why
+            except Exception as e:
+                print(f"⚠️ Run failed: {e}")
+        finally:
+            _run_lock.release()
+
+# ---------- 3) app ----------
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    watcher = threading.Thread(target=keep_watching, daemon=True)
+    watcher.start()
+    # Catch up on anything submitted while the service was down
+    threading.Thread(target=trigger_run, daemon=True).start()
+    yield
+    _stop.set()
+    watcher.join(timeout=10)
+
+app = FastAPI(lifespan=lifespan)
+
+@app.post("/sheets-webhook")
+def sheets_webhook(request: Request, background: BackgroundTasks) -> Response:
+    if request.headers.get("X-Goog-Channel-Token") != WEBHOOK_TOKEN:
+        return Response(status_code=403)
+
+    # "sync" is the handshake sent when a channel opens; "update" means the file changed.
+    # Our own "Processed" writes also count as updates — the follow-up run
+    # stops at run_once()'s cheap pre-check.
+    if request.headers.get("X-Goog-Resource-State") == "update":
+        background.add_task(trigger_run)
+
+    # Answer right away; Drive retries notifications that aren't acknowledged quickly
+    return Response(status_code=200)